@@ -116,7 +116,10 @@ class Config:
             their names (as it is defined in the config file) as keys
             and the `Repo` instances as values.
         """
-        return {name: self.get_repo(name) for name in self.get_repos_config()}
+        repo_defaults = self._config.get('defaults', {}).get('repos', {})
+        return Repo.factory_many(self.get_repos_config(),
+                                 repo_defaults,
+                                 self.top_repo_path)
 
     def get_bitbake_targets(self):
         """
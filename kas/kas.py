@@ -142,6 +142,15 @@ def kas(argv):
 
     logging.info('%s %s started', os.path.basename(sys.argv[0]), __version__)
 
+    try:
+        # kas schedules subprocess- and pipe-heavy tasks which benefit
+        # from uvloop's libuv reactor; use it if it is installed
+        import uvloop
+        uvloop.install()
+        logging.debug('Using uvloop as event loop')
+    except ImportError:
+        pass
+
     loop = asyncio.get_event_loop()
 
     for sig in (signal.SIGINT, signal.SIGTERM):
@@ -30,7 +30,8 @@ import os
 import pprint
 import sys
 from .libkas import (ssh_cleanup_agent, ssh_setup_agent, ssh_no_host_key_check,
-                     get_build_environ, repos_fetch, repos_apply_patches)
+                     get_build_environ, repos_fetch, repos_checkout,
+                     repos_apply_patches)
 from .includehandler import IncludeException
 
 __license__ = 'MIT'
@@ -333,8 +334,7 @@ class ReposCheckout(Command):
         return 'repos_checkout'
 
     def execute(self, ctx):
-        for repo in ctx.config.get_repos():
-            repo.checkout()
+        repos_checkout(ctx.config.get_repos())
 
 
 class InitSetupRepos(Command):
@@ -377,9 +377,7 @@ class SetupReposStep(Command):
             ctx.missing_repos.append(ctx.config.get_repo(repo_name))
 
         repos_fetch(ctx.missing_repos)
-
-        for repo in ctx.missing_repos:
-            repo.checkout()
+        repos_checkout(ctx.missing_repos)
 
         ctx.config.repo_dict.update(
             {repo.name: repo for repo in ctx.missing_repos})
@@ -405,9 +403,7 @@ class FinishSetupRepos(Command):
     def execute(self, ctx):
         # now fetch everything with complete config and check out layers
         repos_fetch(ctx.config.get_repos())
-
-        for repo in ctx.config.get_repos():
-            repo.checkout()
+        repos_checkout(ctx.config.get_repos())
 
         logging.debug('Configuration from config file:\n%s',
                       pprint.pformat(ctx.config.get_config()))
@@ -159,6 +159,25 @@ def find_program(paths, name):
     return None
 
 
+async def fetch_all_async(repos, concurrency=None):
+    """
+        Fetches all repositories concurrently, limited to `concurrency`
+        fetches at a time. Returns the list of fetch results, with
+        exceptions reported as results instead of being raised.
+    """
+    if concurrency is None:
+        # fetches are network-bound, so allow more tasks than cores
+        concurrency = min(32, (os.cpu_count() or 1) * 4)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(repo):
+        async with sem:
+            return await repo.fetch_async()
+
+    return await asyncio.gather(*[fetch_one(repo) for repo in repos],
+                                return_exceptions=True)
+
+
 def repos_fetch(repos):
     """
         Fetches the list of repositories to the kas_work_dir.
@@ -166,9 +185,26 @@ def repos_fetch(repos):
     if len(repos) == 0:
         return
 
+    loop = asyncio.get_event_loop()
+    results = loop.run_until_complete(fetch_all_async(repos))
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+        if result:
+            sys.exit(result)
+
+
+def repos_checkout(repos):
+    """
+        Checks out the correct revision of each repository.
+    """
+    if len(repos) == 0:
+        return
+
     tasks = []
     for repo in repos:
-        tasks.append(asyncio.ensure_future(repo.fetch_async()))
+        tasks.append(asyncio.ensure_future(repo.checkout_async()))
 
     loop = asyncio.get_event_loop()
     loop.run_until_complete(asyncio.wait(tasks))
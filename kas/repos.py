@@ -26,6 +26,10 @@
 import re
 import os
 import sys
+import json
+import stat
+import errno
+import asyncio
 import logging
 from urllib.parse import urlparse
 from tempfile import TemporaryDirectory
@@ -36,6 +40,152 @@ __license__ = 'MIT'
 __copyright__ = 'Copyright (c) Siemens AG, 2017-2018'
 
 
+if sys.version_info >= (3, 9):
+    def _remove_ref_prefix(refspec):
+        return refspec.removeprefix('refs/')
+else:
+    def _remove_ref_prefix(refspec):
+        ref_prefix = 'refs/'
+        return refspec[refspec.startswith(ref_prefix) and len(ref_prefix):]
+
+
+# layer entries with one of these values are left out of the build
+_DISABLED_LAYER_VALUES = \
+    frozenset(['disabled', 'excluded', 'n', 'no', '0', 'false'])
+
+_existing_dirs = set()
+
+
+def _makedirs_cached(path):
+    """
+        os.makedirs(exist_ok=True) variant that skips the syscalls for
+        directories this process already created.
+    """
+    if path not in _existing_dirs:
+        os.makedirs(path, exist_ok=True)
+        _existing_dirs.add(path)
+
+
+_premirrors_cache = (None, None, [])
+
+
+def _get_premirrors():
+    """
+        Returns the KAS_PREMIRRORS substitutions as a tuple of a
+        combined regex and a list of (compiled regex, replacement)
+        tuples. The combined regex matches iff any expression matches
+        and allows rejecting a URL with a single scan; it is None if
+        the expressions cannot be merged. The environment variable is
+        parsed and compiled once and only re-parsed if its value
+        changes.
+    """
+    global _premirrors_cache
+    mirrors = os.environ.get('KAS_PREMIRRORS', '')
+    if _premirrors_cache[0] != mirrors:
+        parsed = []
+        for mirror in mirrors.split('\n'):
+            try:
+                expr, subst = mirror.split()
+            except ValueError:
+                continue
+            parsed.append((re.compile(expr), subst))
+        # joining patterns renumbers their capture groups, which would
+        # break backreferences in any entry after the first; only
+        # build the combined fast path from group-free expressions
+        if parsed and all(expr.groups == 0 for (expr, _) in parsed):
+            combined = re.compile('|'.join('(?:{})'.format(expr.pattern)
+                                           for (expr, _) in parsed))
+        else:
+            combined = None
+        _premirrors_cache = (mirrors, combined, parsed)
+    return _premirrors_cache[1:]
+
+
+class _RevisionCache:
+    """
+        Persistent cache for resolved revisions. Entries are keyed by
+        repository path and refspec and are stamped with the
+        modification times of the git ref files, so they survive
+        across kas invocations but never outlive a ref update.
+    """
+
+    CACHE_FILE = '.kas-revision-cache.json'
+
+    def __init__(self):
+        self._cache = None
+
+    def _file(self):
+        return os.path.join(get_context().kas_work_dir, self.CACHE_FILE)
+
+    def _load(self):
+        if self._cache is None:
+            try:
+                with open(self._file()) as fds:
+                    self._cache = json.load(fds)
+            except (OSError, ValueError):
+                self._cache = {}
+        return self._cache
+
+    def _save(self):
+        # write atomically so concurrent kas instances never read a
+        # partial cache file
+        try:
+            tmpfile = self._file() + '.' + str(os.getpid())
+            with open(tmpfile, 'w') as fds:
+                json.dump(self._cache, fds)
+            os.replace(tmpfile, self._file())
+        except OSError:
+            pass
+
+    @staticmethod
+    def _key(repo):
+        return repo.path + '\0' + repo.refspec
+
+    @staticmethod
+    def _stamp(repo):
+        git_dir = os.path.join(repo.path, '.git')
+        if not os.path.isdir(git_dir):
+            return None
+        ref = repo.refspec
+        if ref.startswith('refs/'):
+            ref = ref[len('refs/'):]
+        # revision only resolves origin/<ref>, so stamp just the files
+        # that back that ref; .git/HEAD would invalidate the entry on
+        # every checkout without influencing the cached output
+        stamp = []
+        for path in [os.path.join(git_dir, 'packed-refs'),
+                     os.path.join(git_dir, 'refs', 'remotes',
+                                  'origin', ref)]:
+            try:
+                stamp.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                stamp.append(0)
+        return stamp
+
+    def lookup(self, repo):
+        stamp = self._stamp(repo)
+        if stamp is None:
+            return None
+        entry = self._load().get(self._key(repo))
+        if entry and entry[0] == stamp:
+            return entry[1]
+        return None
+
+    def store(self, repo, revision):
+        stamp = self._stamp(repo)
+        if stamp is None:
+            return
+        self._load()[self._key(repo)] = [stamp, revision]
+        self._save()
+
+    def drop(self, repo):
+        if self._load().pop(self._key(repo), None) is not None:
+            self._save()
+
+
+_REVISION_CACHE = _RevisionCache()
+
+
 class Repo:
     """
         Represents a repository in the kas configuration.
@@ -50,40 +200,60 @@ class Repo:
         self._layers = layers
         self._patches = patches
         self.operations_disabled = disable_operations
+        # layer paths only depend on constructor arguments, resolve
+        # them right away
+        self.layers = [os.path.join(path, layer).rstrip(os.sep + '.')
+                       for layer in layers]
 
     def __getattr__(self, item):
-        if item == 'layers':
-            return [os.path.join(self.path, layer).rstrip(os.sep + '.')
-                    for layer in self._layers]
+        # Lazy attributes are computed once and stored on the instance
+        # so that further accesses bypass __getattr__ completely.
+        if item == 'ref_name':
+            value = _remove_ref_prefix(self.refspec) if self.refspec else None
         elif item == 'qualified_name':
             url = urlparse(self.url)
-            return ('{url.netloc}{url.path}'
-                    .format(url=url)
-                    .replace('@', '.')
-                    .replace(':', '.')
-                    .replace('/', '.')
-                    .replace('*', '.'))
+            value = ('{url.netloc}{url.path}'
+                     .format(url=url)
+                     .replace('@', '.')
+                     .replace(':', '.')
+                     .replace('/', '.')
+                     .replace('*', '.'))
         elif item == 'effective_url':
-            mirrors = os.environ.get('KAS_PREMIRRORS', '')
-            for mirror in mirrors.split('\n'):
-                try:
-                    expr, subst = mirror.split()
-                    if re.match(expr, self.url):
-                        return re.sub(expr, subst, self.url)
-                except ValueError:
-                    continue
-            return self.url
+            value = self.url
+            (combined, mirrors) = _get_premirrors()
+            if mirrors and (combined is None or combined.match(self.url)):
+                for (expr, subst) in mirrors:
+                    match = expr.match(self.url)
+                    if match:
+                        # reuse the match for the substitution instead
+                        # of scanning the url a second time via re.sub
+                        value = match.expand(subst) \
+                            + self.url[match.end():]
+                        break
         elif item == 'revision':
             if not self.refspec:
-                return None
-            (_, output) = run_cmd(self.resolve_branch_cmd(),
-                                  cwd=self.path, fail=False)
-            if output:
-                return output.strip()
-            return self.refspec
+                value = None
+            else:
+                value = _REVISION_CACHE.lookup(self)
+                if value is None:
+                    (_, output) = run_cmd(self.resolve_branch_cmd(),
+                                          cwd=self.path, fail=False)
+                    value = output.strip() if output else self.refspec
+                    _REVISION_CACHE.store(self, value)
+        else:
+            # Default behaviour
+            raise AttributeError(item)
 
-        # Default behaviour
-        raise AttributeError
+        self.__dict__[item] = value
+        return value
+
+    def _invalidate_revision(self):
+        """
+            Drops the cached revision after operations that may move it.
+        """
+        self.__dict__.pop('revision', None)
+        if self.refspec:
+            _REVISION_CACHE.drop(self)
 
     def __str__(self):
         return '%s:%s %s %s' % (self.url, self.refspec,
@@ -95,10 +265,9 @@ class Repo:
             Returns a Repo instance depending on params.
         """
         layers_dict = repo_config.get('layers', {'': None})
-        layers = list(filter(lambda x, laydict=layers_dict:
-                             str(laydict[x]).lower() not in
-                             ['disabled', 'excluded', 'n', 'no', '0', 'false'],
-                             layers_dict))
+        layers = [layer for layer in layers_dict
+                  if str(layers_dict[layer]).lower()
+                  not in _DISABLED_LAYER_VALUES]
         default_patch_repo = repo_defaults.get('patches', {}).get('repo', None)
         patches_dict = repo_config.get('patches', {})
         patches = []
@@ -152,6 +321,20 @@ class Repo:
                                  disable_operations)
         raise NotImplementedError('Repo type "%s" not supported.' % typ)
 
+    @staticmethod
+    def factory_many(repos_config, repo_defaults, repo_fallback_path):
+        """
+            Returns a dictionary of Repo instances, one per configuration
+            entry. Building the instances involves no repository
+            operations, so the repos can be fetched concurrently
+            afterwards.
+        """
+        return {name: Repo.factory(name,
+                                   repos_config[name] or {},
+                                   repo_defaults,
+                                   repo_fallback_path)
+                for name in repos_config}
+
     @staticmethod
     def get_root_path(path, fallback=True):
         """
@@ -175,6 +358,25 @@ class RepoImpl(Repo):
         Provides a generic implementation for a Repo.
     """
 
+    # separates the output sections of combined probe commands
+    PROBE_SEPARATOR = '__kas_probe__'
+
+    def combined_fetch_probe_cmd(self):
+        """
+            Returns a command that updates the remote url and probes the
+            refspec in a single subprocess, or None if the implementation
+            does not support batching.
+        """
+        return None
+
+    def combined_checkout_probe_cmd(self):
+        """
+            Returns a command that checks for local changes and resolves
+            the remote branch in a single subprocess, or None if the
+            implementation does not support batching.
+        """
+        return None
+
     async def fetch_async(self):
         """
             Starts asynchronous repository fetch.
@@ -188,7 +390,7 @@ class RepoImpl(Repo):
 
         # fetch to refdir
         if refdir and not os.path.exists(sdir):
-            os.makedirs(refdir, exist_ok=True)
+            _makedirs_cached(refdir)
             with TemporaryDirectory(prefix=self.qualified_name + '.',
                                     dir=refdir) as tmpdir:
                 (retc, _) = await run_cmd_async(
@@ -199,7 +401,7 @@ class RepoImpl(Repo):
 
                 logging.debug('Created repo ref for %s', self.qualified_name)
                 try:
-                    os.rename(tmpdir, sdir)
+                    os.replace(tmpdir, sdir)
                     if sys.version_info < (3, 8):
                         # recreate dir so cleanup handler can delete it
                         os.makedirs(tmpdir, exist_ok=True)
@@ -208,40 +410,71 @@ class RepoImpl(Repo):
                                   self.qualified_name)
 
         if not os.path.exists(self.path):
-            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            _makedirs_cached(os.path.dirname(self.path))
             (retc, _) = await run_cmd_async(
                 self.clone_cmd(sdir, createref=False),
                 cwd=get_context().kas_work_dir)
-            if retc == 0:
-                logging.info('Repository %s cloned', self.name)
-
-        # Make sure the remote origin is set to the value
-        # in the kas file to avoid surprises
-        try:
-            (retc, output) = await run_cmd_async(
-                self.set_remote_url_cmd(),
-                cwd=self.path,
-                liveupdate=False)
             if retc != 0:
+                logging.error('Could not clone repository %s', self.name)
                 return retc
-        except NotImplementedError:
-            logging.warning('Repo implementation does not support changing '
-                            'the remote url.')
-
-        # take what came out of clone and stick to that forever
-        if self.refspec is None:
-            return 0
+            logging.info('Repository %s cloned', self.name)
 
-        if not get_context().update:
-            # Does refspec exist in the current repository?
-            (retc, output) = await run_cmd_async(self.contains_refspec_cmd(),
+        if not os.path.exists(self.path):
+            # never probe a non-existing repository: the probes run
+            # with fail=False and an exec failure would be mistaken
+            # for a missing refspec
+            logging.error('Repository %s not found at %s',
+                          self.name, self.path)
+            return errno.ENOENT
+
+        # Make sure the remote origin is set to the value in the kas
+        # file to avoid surprises; where supported, the remote update
+        # and the refspec probe are batched into a single subprocess
+        probe_cmd = None
+        if self.refspec is not None and not get_context().update:
+            probe_cmd = self.combined_fetch_probe_cmd()
+
+        if probe_cmd:
+            (retc, output) = await run_cmd_async(probe_cmd,
                                                  cwd=self.path,
                                                  fail=False,
                                                  liveupdate=False)
+            if retc == 3:
+                logging.error('Could not set remote url of repository %s',
+                              self.name)
+                return retc
             if retc == 0:
+                # Refspec does exist in the current repository
                 logging.info('Repository %s already contains %s as %s',
                              self.name, self.refspec, output.strip())
                 return retc
+        else:
+            try:
+                (retc, output) = await run_cmd_async(
+                    self.set_remote_url_cmd(),
+                    cwd=self.path,
+                    liveupdate=False)
+                if retc != 0:
+                    return retc
+            except NotImplementedError:
+                logging.warning('Repo implementation does not support '
+                                'changing the remote url.')
+
+            # take what came out of clone and stick to that forever
+            if self.refspec is None:
+                return 0
+
+            if not get_context().update:
+                # Does refspec exist in the current repository?
+                (retc, output) = await run_cmd_async(
+                    self.contains_refspec_cmd(),
+                    cwd=self.path,
+                    fail=False,
+                    liveupdate=False)
+                if retc == 0:
+                    logging.info('Repository %s already contains %s as %s',
+                                 self.name, self.refspec, output.strip())
+                    return retc
 
         # Try to fetch if refspec is missing or if --update argument was passed
         (retc, output) = await run_cmd_async(self.fetch_cmd(),
@@ -252,26 +485,45 @@ class RepoImpl(Repo):
                             self.name, output)
         else:
             logging.info('Repository %s updated', self.name)
+            self._invalidate_revision()
         return 0
 
-    def checkout(self):
+    async def checkout_async(self):
         """
-            Checks out the correct revision of the repo.
+            Checks out the correct revision of the repo asynchronously.
         """
         if self.operations_disabled or self.refspec is None:
-            return
+            return 0
 
+        probe_cmd = None
         if not get_context().force_checkout:
-            # Check if repos is dirty
-            (_, output) = run_cmd(self.is_dirty_cmd(),
-                                  cwd=self.path,
-                                  fail=False)
-            if output:
-                logging.warning('Repo %s is dirty - no checkout', self.name)
-                return
+            probe_cmd = self.combined_checkout_probe_cmd()
 
-        (_, output) = run_cmd(self.resolve_branch_cmd(),
-                              cwd=self.path, fail=False)
+        if probe_cmd:
+            (_, probe) = await run_cmd_async(probe_cmd, cwd=self.path,
+                                             fail=False)
+            (dirty, sep, output) = \
+                probe.partition(self.PROBE_SEPARATOR + '\n')
+            if not sep:
+                # separator is missing, treat the output as dirty state
+                dirty = probe
+                output = ''
+            if dirty:
+                logging.warning('Repo %s is dirty - no checkout', self.name)
+                return 0
+        else:
+            if not get_context().force_checkout:
+                # Check if repos is dirty
+                (_, output) = await run_cmd_async(self.is_dirty_cmd(),
+                                                  cwd=self.path,
+                                                  fail=False)
+                if output:
+                    logging.warning('Repo %s is dirty - no checkout',
+                                    self.name)
+                    return 0
+
+            (_, output) = await run_cmd_async(self.resolve_branch_cmd(),
+                                              cwd=self.path, fail=False)
         if output:
             desired_ref = output.strip()
             branch = True
@@ -279,7 +531,74 @@ class RepoImpl(Repo):
             desired_ref = self.refspec
             branch = False
 
-        run_cmd(self.checkout_cmd(desired_ref, branch), cwd=self.path)
+        (retc, _) = await run_cmd_async(
+            self.checkout_cmd(desired_ref, branch), cwd=self.path)
+        # checkout moves HEAD but never origin/<ref>, so only the
+        # in-memory value needs to go; the on-disk entry stays valid
+        self.__dict__.pop('revision', None)
+        return retc
+
+    def checkout(self):
+        """
+            Checks out the correct revision of the repo.
+        """
+        loop = asyncio.get_event_loop()
+        retc = loop.run_until_complete(self.checkout_async())
+        if retc:
+            sys.exit(retc)
+
+    def _discover_patch(self, patch, other_repo):
+        """
+            Resolves the patch files behind a single patch entry. Runs
+            in a worker thread and must only access the file system.
+            Returns the list of (path, patch id) tuples or None if the
+            entry could not be resolved.
+        """
+        path = os.path.join(other_repo.path, patch['path'])
+
+        # one stat tells us whether this is a single patch file or a
+        # quilt directory
+        try:
+            mode = os.stat(path).st_mode
+        except OSError:
+            mode = 0
+
+        if stat.S_ISREG(mode):
+            return [(path, patch['id'])]
+
+        series = os.path.join(path, 'series')
+        if stat.S_ISDIR(mode) and os.path.isfile(series):
+            my_patches = []
+            # series files are small, read them in one go
+            with open(series) as f:
+                lines = f.read().splitlines()
+            for (ln, line) in enumerate(lines, start=1):
+                if not line or line.startswith('#'):
+                    continue
+                pn = line.split(' #')[0].rstrip()
+                if not pn:
+                    logging.error('Could not parse patch file name '
+                                  'from a \'series\' file. '
+                                  '(file: %s, line: %d, repo: %s, '
+                                  'patch entry: %s)',
+                                  series,
+                                  ln,
+                                  self.name,
+                                  patch['id'])
+                    return None
+                p = os.path.join(path, pn)
+                if os.path.isfile(p):
+                    my_patches.append((p, patch['id']))
+                else:
+                    raise FileNotFoundError(p)
+            return my_patches
+
+        logging.error('Could not find patch. '
+                      '(patch path: %s, repo: %s, patch entry: %s)',
+                      path,
+                      self.name,
+                      patch['id'])
+        return None
 
     async def apply_patches_async(self):
         """
@@ -293,55 +612,47 @@ class RepoImpl(Repo):
         if retc:
             return retc
 
-        my_patches = []
-
+        repo_dict = get_context().config.repo_dict
+        # resolve each referenced repo only once, even if many patch
+        # entries share it
+        other_repos = {}
+        entries = []
         for patch in self._patches:
-            other_repo = get_context().config.repo_dict.get(patch['repo'],
-                                                            None)
-
-            if not other_repo:
-                logging.error('Could not find referenced repo. '
-                              '(missing repo: %s, repo: %s, '
-                              'patch entry: %s)',
-                              patch['repo'],
-                              self.name,
-                              patch['id'])
-                return 1
+            other_repo = other_repos.get(patch['repo'])
+            if other_repo is None:
+                other_repo = repo_dict.get(patch['repo'], None)
+                if not other_repo:
+                    logging.error('Could not find referenced repo. '
+                                  '(missing repo: %s, repo: %s, '
+                                  'patch entry: %s)',
+                                  patch['repo'],
+                                  self.name,
+                                  patch['id'])
+                    return 1
+                other_repos[patch['repo']] = other_repo
+
+            entries.append((patch, other_repo))
+
+        # patch discovery only touches the file system, so fan it out
+        # to worker threads; applying has to stay sequential to keep
+        # the patch order and to avoid index races
+        if hasattr(asyncio, 'to_thread'):
+            tasks = [asyncio.to_thread(self._discover_patch,
+                                       patch, other_repo)
+                     for (patch, other_repo) in entries]
+        else:
+            # Python < 3.9
+            loop = asyncio.get_event_loop()
+            tasks = [loop.run_in_executor(None, self._discover_patch,
+                                          patch, other_repo)
+                     for (patch, other_repo) in entries]
+        results = await asyncio.gather(*tasks)
 
-            path = os.path.join(other_repo.path, patch['path'])
-            cmd = []
-
-            if os.path.isfile(path):
-                my_patches.append((path, patch['id']))
-            elif os.path.isdir(path) \
-                    and os.path.isfile(os.path.join(path, 'series')):
-                with open(os.path.join(path, 'series')) as f:
-                    ln = 0
-                    for line in f:
-                        ln += 1
-                        if not line.rstrip('\n') or line.startswith('#'):
-                            continue
-                        pn = line.split(' #')[0].rstrip()
-                        if not pn:
-                            logging.error('Could not parse patch file name from a \'series\' file. '
-                                          '(file: %s, line: %d, repo: %s, patch entry: %s)',
-                                          os.path.join(path, 'series'),
-                                          ln,
-                                          self.name,
-                                          patch['id'])
-                            return 1
-                        p = os.path.join(path, pn)
-                        if os.path.isfile(p):
-                            my_patches.append((p, patch['id']))
-                        else:
-                            raise FileNotFoundError(p)
-            else:
-                logging.error('Could not find patch. '
-                              '(patch path: %s, repo: %s, patch entry: %s)',
-                              path,
-                              self.name,
-                              patch['id'])
+        my_patches = []
+        for result in results:
+            if result is None:
                 return 1
+            my_patches.extend(result)
 
         for (path, patch_id) in my_patches:
             cmd = self.apply_patches_file_cmd(path)
@@ -382,19 +693,28 @@ class GitRepo(RepoImpl):
     """
 
     def remove_ref_prefix(self, refspec):
-        ref_prefix = 'refs/'
-        return refspec[refspec.startswith(ref_prefix) and len(ref_prefix):]
+        return _remove_ref_prefix(refspec)
 
     def add_cmd(self):
         return ['git', 'add', '-A']
 
     def clone_cmd(self, srcdir, createref):
         cmd = ['git', 'clone', '-q']
+        # KAS_GIT_CLONE_FILTER only applies to clones from the network;
+        # once a repo is cloned partially, git marks the remote as a
+        # promisor and later fetches inherit the filter automatically.
+        # Reference clones must never be filtered: a blob-less refdir
+        # cannot serve the objects of the working clones made from it.
+        clone_filter = os.environ.get('KAS_GIT_CLONE_FILTER', '')
         if createref:
             cmd.extend([self.effective_url, '--bare', srcdir])
         elif srcdir:
-            cmd.extend([srcdir, '--reference', srcdir, self.path])
+            # if-able keeps a corrupt or vanished reference repo from
+            # failing the clone; git then just copies the objects
+            cmd.extend([srcdir, '--reference-if-able', srcdir, self.path])
         else:
+            if clone_filter:
+                cmd.append('--filter=' + clone_filter)
             cmd.extend([self.effective_url, self.path])
         return cmd
 
@@ -403,7 +723,29 @@ class GitRepo(RepoImpl):
                 '-m', 'msg']
 
     def contains_refspec_cmd(self):
-        return ['git', 'cat-file', '-t', self.remove_ref_prefix(self.refspec)]
+        return ['git', 'cat-file', '-t', self.ref_name]
+
+    def combined_fetch_probe_cmd(self):
+        # batches set_remote_url_cmd and contains_refspec_cmd into one
+        # subprocess; exit code 3 means setting the remote url failed,
+        # any other non-zero code means the refspec is not available.
+        # A repo probes exactly one refspec per kas invocation, so a
+        # long-lived 'git cat-file --batch' process would never answer
+        # more than one query and is not worth its lifecycle handling.
+        return ['sh', '-c',
+                'git remote set-url origin "$1" || exit 3; '
+                'git cat-file -t "$2"',
+                'sh', self.effective_url,
+                self.ref_name]
+
+    def combined_checkout_probe_cmd(self):
+        # batches is_dirty_cmd and resolve_branch_cmd into one
+        # subprocess, separating their outputs by PROBE_SEPARATOR
+        return ['sh', '-c',
+                'git status -s; echo {sep}; '
+                'git rev-parse --verify -q "origin/$1"; true'
+                .format(sep=self.PROBE_SEPARATOR),
+                'sh', self.ref_name]
 
     def fetch_cmd(self):
         cmd = ['git', 'fetch', '-q']
@@ -411,7 +753,7 @@ class GitRepo(RepoImpl):
             cmd.extend(['origin',
                         '+' + self.refspec
                         + ':refs/remotes/origin/'
-                        + self.remove_ref_prefix(self.refspec)])
+                        + self.ref_name])
 
         return cmd
 
@@ -421,12 +763,12 @@ class GitRepo(RepoImpl):
     def resolve_branch_cmd(self):
         return ['git', 'rev-parse', '--verify', '-q',
                 'origin/{refspec}'.
-                format(refspec=self.remove_ref_prefix(self.refspec))]
+                format(refspec=self.ref_name)]
 
     def checkout_cmd(self, desired_ref, branch):
         cmd = ['git', 'checkout', '-q', self.remove_ref_prefix(desired_ref)]
         if branch:
-            cmd.extend(['-B', self.remove_ref_prefix(self.refspec)])
+            cmd.extend(['-B', self.ref_name])
         if get_context().force_checkout:
             cmd.append('--force')
         return cmd
@@ -434,7 +776,7 @@ class GitRepo(RepoImpl):
     def prepare_patches_cmd(self):
         return ['git', 'checkout', '-q', '-B',
                 'patched-{refspec}'.
-                format(refspec=self.remove_ref_prefix(self.refspec))]
+                format(refspec=self.ref_name)]
 
     def apply_patches_file_cmd(self, path):
         return ['git', 'apply', '--whitespace=nowarn', path]
@@ -25,6 +25,7 @@ import pytest
 import shutil
 from kas import kas
 from kas.libkas import run_cmd
+from kas.repos import GitRepo
 
 
 def test_refspec_switch(changedir, tmpdir):
@@ -97,3 +98,41 @@ def test_url_no_refspec(changedir, tmpdir):
     os.chdir(tdir)
     with pytest.raises(SystemExit):
         kas.kas(['shell', 'test4.yml', '-c', 'true'])
+
+
+def test_clone_failure(changedir, tmpdir):
+    """
+        Test that a repository that cannot be cloned fails the kas run.
+    """
+    tdir = str(tmpdir / 'test_clone_failure')
+    shutil.copytree('tests/test_refspec', tdir)
+    os.chdir(tdir)
+    with pytest.raises(SystemExit) as einfo:
+        kas.kas(['shell', 'test5.yml', '-c', 'true'])
+    assert einfo.value.code not in [0, None]
+    assert not os.path.exists('notexist')
+
+
+def test_premirror_substitution(changedir, tmpdir):
+    """
+        Test that KAS_PREMIRRORS substitutes matching repo urls,
+        supports backreferences in any entry and leaves other urls
+        untouched.
+    """
+    os.environ['KAS_PREMIRRORS'] = \
+        'https://github\\.com/siemens/ file:///mirror/siemens/\n' \
+        '(https)://example\\.com/(\\w+)/ \\1://mirror.net/\\2/'
+    try:
+        repo = GitRepo('kas', 'https://github.com/siemens/kas.git',
+                       'kas', 'master', [], [], False)
+        assert repo.effective_url == 'file:///mirror/siemens/kas.git'
+
+        repo = GitRepo('meta', 'https://example.com/proj/meta.git',
+                       'meta', 'master', [], [], False)
+        assert repo.effective_url == 'https://mirror.net/proj/meta.git'
+
+        repo = GitRepo('other', 'https://gitlab.com/proj/other.git',
+                       'other', 'master', [], [], False)
+        assert repo.effective_url == 'https://gitlab.com/proj/other.git'
+    finally:
+        del os.environ['KAS_PREMIRRORS']